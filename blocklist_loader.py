@@ -1,9 +1,16 @@
 
 import sqlite3
 import socket
+import sys
 import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, List, Optional, Set, Tuple
 
+try:
+    import ahocorasick  # optional: pip install pyahocorasick
+except ImportError:
+    ahocorasick = None  # fall back to the pure-Python label trie
+
 class BlocklistEntry:
     __slots__ = ("domain", "ip_address", "category", "severity", "source")
     def __init__(self, domain: str, ip_address: Optional[str], category: str, severity: str, source: Optional[str]):
@@ -16,16 +23,19 @@ class BlocklistEntry:
 class Blocklist:
     """
     Loads blocklist from SQLite/CSV/JSON and provides fast IP/domain matching.
-    - Domain matching is exact or suffix-match (e.g., *.example.com)
+    - Domain matching is exact or suffix-match (e.g., *.example.com) via an
+      Aho-Corasick automaton over reversed domains when pyahocorasick is
+      installed, else a trie keyed on reversed labels; both cost O(len(domain))
     - IP matching is exact (optional; most entries are domain-based)
     - DNS pre-resolution caches A records for domains to speed IP matching
     """
     def __init__(self):
-        self._domains: Set[str] = set()
-        self._domain_suffixes: Set[str] = set()  # like ".doubleclick.net"
+        self._suffix_trie: Dict[str, dict] = {}  # reversed labels -> node; "$" -> (category, severity)
+        self._automaton = None  # ahocorasick.Automaton over "^" + reversed ".domain"
         self._ips: Set[str] = set()
-        self._meta: Dict[str, Tuple[str, str]] = {}  # domain -> (category, severity)
+        self._meta: Dict[str, Tuple[str, str]] = {}  # domain -> (category, severity); the domain set
         self._dnscache: Dict[str, Tuple[float, Set[str]]] = {}  # domain -> (ts, {ip,...})
+        self._ip_to_domain: Dict[str, str] = {}  # resolved ip -> first domain (blocklist order) resolving to it
         self.dns_ttl_sec = 3600
 
     def load_from_sqlite(self, path: str, table: str = "blocklist") -> int:
@@ -55,25 +65,51 @@ class Blocklist:
     def _ingest_rows(self, rows: List[Tuple[str, Optional[str], str, str]]) -> int:
         count = 0
         for domain, ip, category, severity in rows:
+            # a handful of distinct values shared by every entry and every logged row
+            category = sys.intern(category)
+            severity = sys.intern(severity)
             if domain:
                 d = domain.lower().strip()
-                self._domains.add(d)
-                # suffix form for fast endswith checks
-                if not d.startswith("."):
-                    self._domain_suffixes.add("." + d)
-                else:
-                    self._domain_suffixes.add(d)
+                if ahocorasick is None:
+                    self._insert_suffix(d, category, severity)
                 self._meta[d] = (category, severity)
                 count += 1
             if ip:
                 self._ips.add(ip.strip())
+        if ahocorasick is not None and self._meta:
+            self._build_automaton()
         return count
 
+    def _build_automaton(self):
+        # Words are "^" + reversed(".base"), e.g. "^moc.live." for evil.com. The
+        # "^" anchors hits to the end of the query domain and the trailing "." to a
+        # label boundary, so notevil.com ("^moc.liveton.") never hits evil.com.
+        A = ahocorasick.Automaton()
+        for d, (category, severity) in self._meta.items():
+            base = d.strip(".")
+            A.add_word("^" + ("." + base)[::-1], (base, category, severity))
+        A.make_automaton()
+        self._automaton = A
+
+    def _insert_suffix(self, domain: str, category: str, severity: str):
+        node = self._suffix_trie
+        for label in reversed(domain.strip(".").split(".")):
+            node = node.setdefault(label, {})
+        node["$"] = (category, severity)
+
     def _dns_lookup(self, domain: str) -> Set[str]:
         now = time.time()
         cached = self._dnscache.get(domain)
         if cached and now - cached[0] < self.dns_ttl_sec:
             return cached[1]
+        ips = self._resolve_a(domain)
+        self._dnscache[domain] = (now, ips)
+        self._rebuild_ip_map()
+        return ips
+
+    @staticmethod
+    def _resolve_a(domain: str) -> Set[str]:
+        # network only, no shared state: safe to run on worker threads
         ips: Set[str] = set()
         try:
             # gethostbyname_ex returns (hostname, aliaslist, ipaddrlist)
@@ -82,41 +118,76 @@ class Blocklist:
                 ips.add(ip)
         except Exception:
             pass
-        self._dnscache[domain] = (now, ips)
         return ips
 
-    def pre_resolve_dns(self, limit: Optional[int] = 200) -> int:
-        n = 0
-        for d in list(self._domains):
-            if limit and n >= limit:
-                break
-            self._dns_lookup(d)
-            n += 1
-        return n
+    def _rebuild_ip_map(self):
+        # derive the reverse map from _dnscache in blocklist order, so a shared IP always
+        # belongs to the first listed domain that currently resolves to it
+        ip_to_domain: Dict[str, str] = {}
+        for d in self._meta:
+            cached = self._dnscache.get(d)
+            if cached:
+                for ip in cached[1]:
+                    ip_to_domain.setdefault(ip, d)
+        self._ip_to_domain = ip_to_domain
+
+    def pre_resolve_dns(self, limit: Optional[int] = 200, workers: int = 64) -> int:
+        domains = list(self._meta)
+        if limit:
+            domains = domains[:limit]
+        # entries still within dns_ttl_sec are served from cache; only stale ones hit DNS
+        now = time.time()
+        domains = [d for d in domains
+                   if d not in self._dnscache or now - self._dnscache[d][0] >= self.dns_ttl_sec]
+        if not domains:
+            return 0
+        # lookups are wait-bound; fan them out instead of paying limit x RTT serially.
+        # Workers only return IP sets; shared state is updated here on the calling thread.
+        with ThreadPoolExecutor(max_workers=min(workers, len(domains))) as ex:
+            for d, ips in zip(domains, ex.map(self._resolve_a, domains)):
+                self._dnscache[d] = (now, ips)
+        self._rebuild_ip_map()
+        return len(domains)
+
+    def has_domains(self) -> bool:
+        return bool(self._meta)
 
     def match_ip(self, ip: str) -> Optional[Tuple[str, str, str]]:
         """Return (matched_domain_or_ip, category, severity) if ip matches via exact IP or DNS-resolved domain set."""
         if ip in self._ips:
             # pick a generic tag if we stored IP directly (rare)
             return (ip, "Unknown", "Medium")
-        # Try mapping to any domain we know (reverse via A-record forward map)
-        for d, (category, severity) in self._meta.items():
-            ips = self._dnscache.get(d, (0, set()))[1] or self._dns_lookup(d)
-            if ip in ips:
-                return (d, category, severity)
+        # Map back to a domain we resolved (reverse of the A-record forward map)
+        d = self._ip_to_domain.get(ip)
+        if d:
+            category, severity = self._meta[d]
+            return (d, category, severity)
         return None
 
     def match_domain(self, domain: str) -> Optional[Tuple[str, str, str]]:
         if not domain:
             return None
         d = domain.lower().strip()
-        if d in self._domains:
-            cat, sev = self._meta.get(d, ("Unknown", "Low"))
-            return (d, cat, sev)
-        # suffix: "sub.example.com" endswith ".example.com"
-        for s in self._domain_suffixes:
-            if d.endswith(s):
-                base = s[1:]
-                cat, sev = self._meta.get(base, ("Unknown", "Low"))
-                return (base, cat, sev)
-        return None
+        meta = self._meta.get(d)
+        if meta:
+            return (d, meta[0], meta[1])
+        if self._automaton is not None:
+            # every word starts at "^", so hits arrive shortest first; keep the longest
+            best = None
+            for _, hit in self._automaton.iter("^" + ("." + d.strip("."))[::-1]):
+                best = hit
+            return best
+        # suffix: walk "com" -> "example" -> "sub"; the deepest terminal node wins
+        labels = d.strip(".").split(".")
+        node = self._suffix_trie
+        best = None
+        for depth, label in enumerate(reversed(labels), 1):
+            node = node.get(label)
+            if node is None:
+                break
+            if "$" in node:
+                best = (depth, node["$"])
+        if best is None:
+            return None
+        depth, (cat, sev) = best
+        return (".".join(labels[-depth:]), cat, sev)
@@ -2,38 +2,140 @@ import argparse
 import datetime as dt
 import socket
 import sqlite3
+import struct
+import threading
 import time
 import psutil
+from concurrent.futures import ThreadPoolExecutor
 import ipaddress
-from typing import Optional, List, Tuple, Set
+from typing import Dict, Optional, List, Tuple, Set
 import os
 from datetime import datetime
 
 from blocklist_loader import Blocklist
 from notifier import notify
 
+# dnspython gives PTR lookups a real per-call deadline; the socket fallback is bounded
+# only by the OS resolver's own timeouts
+try:
+    import dns.resolver
+    import dns.reversename
+    _dns_resolver = dns.resolver.Resolver()
+except Exception:  # not installed, or no usable system resolver config
+    _dns_resolver = None
+
 # notification cache (dest_domain/process -> last_time)
 _notify_cache = {}
 
+# rDNS is wait-bound, so lookups for one scan are fanned out across threads
+RDNS_WORKERS = 32
+
+# rDNS cache (ip -> (resolved_at, host or "")); failures expire sooner than hits
+RDNS_POS_TTL = 300.0
+RDNS_NEG_TTL = 30.0
+RDNS_CACHE_MAX = 4096
+_rdns_cache: Dict[str, Tuple[float, str]] = {}
+_rdns_lock = threading.Lock()
+
 # ---------- helpers ----------
 
+# (network, mask) for 10/8, 172.16/12, 192.168/16, 127/8 and 169.254/16
+_PRIVATE_V4 = (
+    (0x0A000000, 0xFF000000),
+    (0xAC100000, 0xFFF00000),
+    (0xC0A80000, 0xFFFF0000),
+    (0x7F000000, 0xFF000000),
+    (0xA9FE0000, 0xFFFF0000),
+)
+
 def is_private_ip(ip: str) -> bool:
+    if ":" in ip:
+        # IPv6 is rare here; take the slow but complete path
+        try:
+            ipobj = ipaddress.ip_address(ip)
+            return ipobj.is_private or ipobj.is_loopback or ipobj.is_link_local
+        except ValueError:
+            return False
     try:
-        ipobj = ipaddress.ip_address(ip)
-        return ipobj.is_private or ipobj.is_loopback or ipobj.is_link_local
-    except ValueError:
+        n = struct.unpack("!I", socket.inet_aton(ip))[0]
+    except OSError:
         return False
+    for net, mask in _PRIVATE_V4:
+        if n & mask == net:
+            return True
+    return False
 
 def reverse_dns(ip: str, timeout: float = 0.25) -> str:
+    now = time.time()
+    with _rdns_lock:
+        cached = _rdns_cache.pop(ip, None)
+        if cached:
+            # move to the most-recent end so eviction below is least-recently-used
+            _rdns_cache[ip] = cached
+    if cached:
+        ts, host = cached
+        if now - ts < (RDNS_POS_TTL if host else RDNS_NEG_TTL):
+            return host
     try:
-        socket.setdefaulttimeout(timeout)
-        host, _, _ = socket.gethostbyaddr(ip)
-        return host
+        if _dns_resolver is not None:
+            answer = _dns_resolver.resolve(dns.reversename.from_address(ip), "PTR", lifetime=timeout)
+            host = answer[0].target.to_text(omit_final_dot=True)
+        else:
+            host, _, _ = socket.gethostbyaddr(ip)
     except Exception:
-        return ""
-
-def ensure_detections_db(path: str):
-    conn = sqlite3.connect(path)
+        host = ""
+    with _rdns_lock:
+        # re-insert so dict order tracks recency; evict the least recently used past the cap
+        _rdns_cache.pop(ip, None)
+        _rdns_cache[ip] = (now, host)
+        while len(_rdns_cache) > RDNS_CACHE_MAX:
+            _rdns_cache.pop(next(iter(_rdns_cache)))
+    return host
+
+def process_names() -> Dict[int, str]:
+    # one pass over the process table; psutil reuses its Process objects across calls
+    # and re-keys them on create_time, so recycled PIDs are handled for us
+    names: Dict[int, str] = {}
+    for p in psutil.process_iter(["pid", "name"]):
+        names[p.info["pid"]] = p.info["name"] or ""
+    return names
+
+def resolve_rdns(ips) -> Dict[str, str]:
+    """Reverse-resolve many IPs concurrently; returns {ip: host or ""}."""
+    ips = list(ips)
+    if not ips:
+        return {}
+    with ThreadPoolExecutor(max_workers=min(RDNS_WORKERS, len(ips))) as ex:
+        return dict(zip(ips, ex.map(reverse_dns, ips)))
+
+# secondary indexes serving signaldaemon_export.py filters (time range, match_type, process, severity)
+# (index name, indexed columns)
+_DETECTION_INDEXES = (
+    ("idx_detections_ts", "ts DESC"),
+    ("idx_detections_mt_ts", "match_type, ts DESC"),
+    ("idx_detections_proc", "process_name"),
+    ("idx_sev_rank", "sev_rank, ts DESC"),
+)
+
+# batches at least this large (and at least as large as the table) are inserted with
+# the secondary indexes dropped and rebuilt afterwards, which beats per-row maintenance
+BULK_INDEX_THRESHOLD = 5000
+
+# detections DB path -> open connection (schema + PRAGMAs applied once per path)
+_detections_conns: Dict[str, sqlite3.Connection] = {}
+
+def ensure_detections_db(path: str) -> sqlite3.Connection:
+    conn = _detections_conns.get(path)
+    if conn is not None:
+        return conn
+    # autocommit; DetectionWriter issues its own BEGIN/COMMIT per batch
+    conn = sqlite3.connect(path, isolation_level=None)
+    # WAL avoids the rollback-journal double write; NORMAL drops the per-commit fsync
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA cache_size=-8000")
+    conn.execute("PRAGMA mmap_size=268435456")
+    conn.execute("PRAGMA temp_store=MEMORY")
     cur = conn.cursor()
     cur.execute("""
     CREATE TABLE IF NOT EXISTS detections (
@@ -50,7 +152,8 @@ def ensure_detections_db(path: str):
         matched_domain TEXT,
         category TEXT,
         severity TEXT,
-        match_type TEXT DEFAULT 'match' -- 'match' or 'baseline'
+        match_type TEXT DEFAULT 'match', -- 'match' or 'baseline'
+        sev_rank INTEGER DEFAULT 0 -- Low=1, Medium=2, High=3
     );
     """)
     # migrate older DBs that lack match_type
@@ -58,20 +161,95 @@ def ensure_detections_db(path: str):
         cur.execute("SELECT match_type FROM detections LIMIT 1")
     except sqlite3.OperationalError:
         cur.execute("ALTER TABLE detections ADD COLUMN match_type TEXT DEFAULT 'match'")
-    conn.commit()
-    conn.close()
+    # migrate older DBs that lack sev_rank (backfilled from severity)
+    try:
+        cur.execute("SELECT sev_rank FROM detections LIMIT 1")
+    except sqlite3.OperationalError:
+        cur.execute("ALTER TABLE detections ADD COLUMN sev_rank INTEGER DEFAULT 0")
+        cur.execute("""
+        UPDATE detections SET sev_rank = CASE severity
+            WHEN 'Low' THEN 1
+            WHEN 'Medium' THEN 2
+            WHEN 'High' THEN 3
+            ELSE 0
+        END
+        """)
+    for name, cols in _DETECTION_INDEXES:
+        cur.execute(f"CREATE INDEX IF NOT EXISTS {name} ON detections({cols})")
+    _detections_conns[path] = conn
+    return conn
+
+def drop_indexes(conn: sqlite3.Connection):
+    for name, _ in _DETECTION_INDEXES:
+        conn.execute(f"DROP INDEX IF EXISTS {name}")
+
+def rebuild_indexes(conn: sqlite3.Connection):
+    for name, cols in _DETECTION_INDEXES:
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {name} ON detections({cols})")
+
+def close_detections_db(path: str):
+    conn = _detections_conns.pop(path, None)
+    if conn is not None:
+        # let SQLite refresh planner stats that have drifted since the last run; 0x10000
+        # (3.46+) checks every table, older versions ignore it and use the default checks
+        conn.execute("PRAGMA optimize=0x10002")
+        conn.close()
+
+# fixed column order for detection rows; rows are queued as tuples in this order
+DETECTION_COLUMNS = (
+    "ts", "process_name", "pid", "laddr", "lport", "raddr", "rport",
+    "dest_ip", "dest_domain", "matched_domain", "category", "severity", "match_type",
+    "sev_rank",
+)
+
+_INSERT_SQL = (
+    f"INSERT INTO detections ({', '.join(DETECTION_COLUMNS)}) "
+    f"VALUES ({', '.join('?' * len(DETECTION_COLUMNS))})"
+)
+
+class DetectionWriter:
+    """
+    Keeps one long-lived connection to the detections DB and buffers rows
+    so that each scan is written with a single executemany() transaction.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.conn = ensure_detections_db(path)
+        # one cursor for the writer's lifetime; _INSERT_SQL stays compiled in the statement cache
+        self.cur = self.conn.cursor()
+        self._buf: List[tuple] = []
+
+    def queue(self, row: tuple):
+        self._buf.append(row)
+
+    def flush(self) -> int:
+        if not self._buf:
+            return 0
+        rows, self._buf = self._buf, []
+        cur = self.cur
+        # rebuilding only pays off when the batch dominates the existing table
+        bulk = len(rows) >= BULK_INDEX_THRESHOLD and len(rows) >= self._row_estimate()
+        cur.execute("BEGIN")
+        try:
+            # DDL is transactional in SQLite, so a failed batch rolls the indexes back too
+            if bulk:
+                drop_indexes(self.conn)
+            cur.executemany(_INSERT_SQL, rows)
+            if bulk:
+                rebuild_indexes(self.conn)
+        except Exception:
+            cur.execute("ROLLBACK")
+            raise
+        cur.execute("COMMIT")
+        return len(rows)
 
-def log_detection(path: str, row: dict):
-    conn = sqlite3.connect(path)
-    cur = conn.cursor()
-    cur.execute("""
-    INSERT INTO detections (ts, process_name, pid, laddr, lport, raddr, rport,
-                            dest_ip, dest_domain, matched_domain, category, severity, match_type)
-    VALUES (:ts, :process_name, :pid, :laddr, :lport, :raddr, :rport,
-            :dest_ip, :dest_domain, :matched_domain, :category, :severity, :match_type)
-    """, row)
-    conn.commit()
-    conn.close()
+    def _row_estimate(self) -> int:
+        # MAX(rowid) is an O(log n) stand-in for COUNT(*) on this append-only table
+        return self.cur.execute("SELECT MAX(rowid) FROM detections").fetchone()[0] or 0
+
+    def close(self):
+        self.flush()
+        close_detections_db(self.path)
 
 def gather_conns(only_established: bool) -> List[psutil._common.sconn]:
     conns = psutil.net_connections(kind="inet")
@@ -79,15 +257,53 @@ def gather_conns(only_established: bool) -> List[psutil._common.sconn]:
         conns = [c for c in conns if getattr(c, "status", "") == psutil.CONN_ESTABLISHED]
     return [c for c in conns if c.raddr]
 
+# directories already checked/created by _ensure_dir
+_ensured_dirs: Set[str] = set()
+
 def _ensure_dir(p: str):
     d = os.path.dirname(os.path.abspath(p))
+    if d in _ensured_dirs:
+        return
     if d and not os.path.exists(d):
         os.makedirs(d, exist_ok=True)
+    _ensured_dirs.add(d)
+
+class MatchLog:
+    """
+    Append-mode handle on the plain-text match log, kept open across scans.
+    Lines are buffered and flushed once per scan instead of reopening per line.
+    """
+    def __init__(self, path: str):
+        _ensure_dir(path)
+        self.path = path
+        self.fh = open(path, "a", encoding="utf-8", buffering=1 << 16)
+
+    def write(self, line: str):
+        self.fh.write(line + "\n")
+
+    def flush(self):
+        self.fh.flush()
+
+    def close(self):
+        self.fh.close()
+
+# match log path -> open MatchLog
+_match_logs: Dict[str, MatchLog] = {}
 
 def _write_log_line(log_path: str, line: str):
-    _ensure_dir(log_path)
-    with open(log_path, "a", encoding="utf-8") as f:
-        f.write(line + "\n")
+    log = _match_logs.get(log_path)
+    if log is None:
+        log = _match_logs[log_path] = MatchLog(log_path)
+    log.write(line)
+
+def flush_match_logs():
+    for log in _match_logs.values():
+        log.flush()
+
+def close_match_logs():
+    while _match_logs:
+        _, log = _match_logs.popitem()
+        log.close()
 
 def log_match_line(log_path: str, severity: str, process: str, pid: int,
                    host: str, category: str, tag: str = ""):
@@ -117,41 +333,66 @@ def scan_once(
     notify_squelch: float = 60.0,
     match_log: str | None = None,
     log_baselines: bool = False,
-    notify_cats: set | None = None
+    notify_cats: set | None = None,
+    writer: Optional[DetectionWriter] = None
 ) -> Tuple[int, int]:
     """
     Returns (match_count, baseline_count).
+    Rows are queued on `writer` and flushed once at the end of the scan; if no
+    writer is given, a temporary one is opened for this scan only.
     """
     sev_order = {"Low": 1, "Medium": 2, "High": 3}
     threshold = sev_order.get(severity_threshold, 3)
 
-    ensure_detections_db(detections_db)
+    own_writer = writer is None
+    if own_writer:
+        writer = DetectionWriter(detections_db)
 
     matches = 0
     baselines = 0
     conns = gather_conns(only_established)
     rdns_hits = 0
     debug_samples = []
+    pid_name = process_names() if conns else {}
+
+    # IP matching needs no network, so decide it up front for every unique destination
+    ip_matches = {
+        c.raddr.ip: None for c in conns
+        if not (external_only and is_private_ip(c.raddr.ip))
+    }
+    for ip in ip_matches:
+        ip_matches[ip] = bl.match_ip(ip)
+
+    # rDNS is skipped only when the hostname cannot change the outcome: with no domain
+    # entries it can't match anything, so it is needed just for rows that get recorded
+    # (logged IP matches, baselines, debug samples)
+    domain_matching = bl.has_domains()
+    need_rdns = [
+        ip for ip, m in ip_matches.items()
+        if domain_matching
+        or (m is None and (log_all or debug))
+        or (m is not None and sev_order.get(m[2], 1) >= threshold)
+    ]
+    # one PTR query per unique destination, all in flight at once
+    ip_to_host = resolve_rdns(need_rdns)
 
     for c in conns:
         dest_ip = c.raddr.ip
         if external_only and is_private_ip(dest_ip):
             continue
 
-        dest_domain = reverse_dns(dest_ip)
+        dest_domain = ip_to_host.get(dest_ip, "")
         if dest_domain:
             rdns_hits += 1
         pid = c.pid or 0
-        try:
-            pname = psutil.Process(pid).name() if pid else ""
-        except Exception:
-            pname = ""
+        pname = pid_name.get(pid, "") if pid else ""
 
+        # domain match first, IP match as fallback
         matched = None
         if dest_domain:
             matched = bl.match_domain(dest_domain)
         if not matched:
-            matched = bl.match_ip(dest_ip)
+            matched = ip_matches[dest_ip]
 
         ts_now = dt.datetime.now(dt.timezone.utc).isoformat().replace("+00:00", "Z")
         laddr_ip = getattr(c.laddr, "ip", "")
@@ -180,23 +421,10 @@ def scan_once(
                                 print(f"[NOTIFY][ERROR] {e} :: {title} | {body}")
                         _notify_cache[key] = now_ts
 
-            row = {
-                "ts": ts_now,
-                "process_name": pname,
-                "pid": pid,
-                "laddr": laddr_ip,
-                "lport": laddr_port,
-                "raddr": raddr_ip,
-                "rport": raddr_port,
-                "dest_ip": dest_ip,
-                "dest_domain": dest_domain,
-                "matched_domain": m_domain,
-                "category": m_cat,
-                "severity": m_sev,
-                "match_type": "match",
-            }
+            row = (ts_now, pname, pid, laddr_ip, laddr_port, raddr_ip, raddr_port,
+                   dest_ip, dest_domain, m_domain, m_cat, m_sev, "match", sev_order.get(m_sev, 0))
             if sev_order.get(m_sev, 1) >= threshold:
-                log_detection(detections_db, row)
+                writer.queue(row)
                 matches += 1
                 if verbose:
                     print(f"[MATCH] {pname} (pid {pid}) -> {dest_ip} ({dest_domain or 'no-rdns'}) :: {m_domain} [{m_cat}/{m_sev}]")
@@ -211,22 +439,9 @@ def scan_once(
                     if key in baseline_seen:
                         continue
                     baseline_seen.add(key)
-                row = {
-                    "ts": ts_now,
-                    "process_name": pname,
-                    "pid": pid,
-                    "laddr": laddr_ip,
-                    "lport": laddr_port,
-                    "raddr": raddr_ip,
-                    "rport": raddr_port,
-                    "dest_ip": dest_ip,
-                    "dest_domain": dest_domain,
-                    "matched_domain": "",
-                    "category": "Baseline",
-                    "severity": "Low",
-                    "match_type": "baseline",
-                }
-                log_detection(detections_db, row)
+                row = (ts_now, pname, pid, laddr_ip, laddr_port, raddr_ip, raddr_port,
+                       dest_ip, dest_domain, "", "Baseline", "Low", "baseline", sev_order["Low"])
+                writer.queue(row)
                 baselines += 1
                 if match_log and log_baselines:
                     host_for_log = dest_domain or dest_ip
@@ -237,6 +452,11 @@ def scan_once(
             elif debug and len(debug_samples) < 15:
                 debug_samples.append((pname, pid, dest_ip, dest_domain))
 
+    writer.flush()
+    if own_writer:
+        writer.close()
+    flush_match_logs()
+
     if verbose:
         total = len(conns)
         print(f"[SCAN] Conns scanned: {total} | rDNS resolved: {rdns_hits} | Matches >= {severity_threshold}: {matches} | Baseline logged: {baselines}")
@@ -272,7 +492,7 @@ def watch(
     bl.load_from_sqlite(blocklist_db)
     bl.pre_resolve_dns(limit=600)
 
-    ensure_detections_db(detections_db)
+    writer = DetectionWriter(detections_db)
 
     baseline_seen: Set[Tuple[int, str, int, str, int]] = set() if dedupe_baseline else None
 
@@ -289,7 +509,8 @@ def watch(
                 log_all=log_all, external_only=external_only,
                 baseline_seen=baseline_seen, dedupe_baseline=dedupe_baseline,
                 do_notify=do_notify, notify_min=notify_min, notify_squelch=notify_squelch,
-                match_log=match_log, log_baselines=log_baselines,notify_cats=notify_cats
+                match_log=match_log, log_baselines=log_baselines,notify_cats=notify_cats,
+                writer=writer
             )
             if duration is not None and (time.time() - start_time) >= duration:
                 print("[WATCH] Duration reached. Exiting.")
@@ -297,8 +518,14 @@ def watch(
             if verbose:
                 print(f"[IDLE] Sleeping {interval:.2f}s ...")
             time.sleep(interval)
+            # re-resolve blocklist domains whose A records are past dns_ttl_sec (fresh ones
+            # are skipped), so IP matching follows DNS changes and retries failed lookups
+            bl.pre_resolve_dns(limit=600)
     except KeyboardInterrupt:
         print("\n[WATCH] Stopped by user.")
+    finally:
+        writer.close()
+        close_match_logs()
 
 # ---------- cli ----------
 
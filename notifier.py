@@ -3,24 +3,38 @@ import platform, subprocess
 
 _IS_WIN = platform.system().lower().startswith("win")
 
-def _notify_windows(title: str, message: str) -> bool:
-    # 1) win11toast with explicit keyword args + no-op click handler
+# Resolve the toast backend once at import, not on every notify() call.
+# Any import failure (missing package, winsdk raising on an unsupported build) must not
+# stop the daemon from starting: fall back to MessageBox and keep the error for its message.
+_toast = None
+_toast_err = "win11toast not loaded"
+if _IS_WIN:
     try:
-        from win11toast import toast
-        # Avoid positional args; force keywords so 'on_click' doesn't get mis-bound.
-        toast(title=title, body=message, icon=None, duration="short",
-              on_click=(lambda *_: None))   # never None → always callable
-        return True
+        from win11toast import toast as _toast
     except Exception as e:
-        # 2) Hard fallback: MessageBox (can’t be missed)
+        _toast = None
+        _toast_err = e
+
+def _notify_windows(title: str, message: str) -> bool:
+    # 1) win11toast with explicit keyword args + no-op click handler
+    err = _toast_err
+    if _toast is not None:
         try:
-            import ctypes
-            MB_ICONINFORMATION = 0x40
-            ctypes.windll.user32.MessageBoxW(0, message, title, MB_ICONINFORMATION)
+            # Avoid positional args; force keywords so 'on_click' doesn't get mis-bound.
+            _toast(title=title, body=message, icon=None, duration="short",
+                   on_click=(lambda *_: None))   # never None → always callable
             return True
-        except Exception as e2:
-            print(f"[NOTIFY] Fallback failed: toast err={e} / msgbox err={e2}")
-            return False
+        except Exception as e:
+            err = e
+    # 2) Hard fallback: MessageBox (can’t be missed)
+    try:
+        import ctypes
+        MB_ICONINFORMATION = 0x40
+        ctypes.windll.user32.MessageBoxW(0, message, title, MB_ICONINFORMATION)
+        return True
+    except Exception as e2:
+        print(f"[NOTIFY] Fallback failed: toast err={err} / msgbox err={e2}")
+        return False
 
 def notify(title: str, message: str, duration: int = 5):
     sent = False
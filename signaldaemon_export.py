@@ -17,10 +17,24 @@ import sqlite3
 import sys
 import json
 import csv
-from typing import List, Tuple, Dict, Any, Optional
+from typing import List, Tuple, Dict, Any, Iterable, Iterator, Optional
 
 SEV_ORDER = {"Low": 1, "Medium": 2, "High": 3}
 
+DEFAULT_COLUMNS = [
+    "ts","process_name","pid","dest_ip","dest_domain","matched_domain","category","severity","match_type","laddr","lport","raddr","rport"
+]
+
+# --unique mode -> GROUP BY key; mirrors the keys built in apply_unique()
+_DOMAIN_KEY = "COALESCE(NULLIF(matched_domain, ''), NULLIF(dest_domain, ''), dest_ip)"
+UNIQUE_KEYS = {
+    "tuple": ["pid", "laddr", "lport", "dest_ip", "rport"],
+    "remote": ["dest_ip"],
+    "domain": [_DOMAIN_KEY],
+    "remote-proc": ["process_name", "dest_ip"],
+    "domain-proc": ["process_name", _DOMAIN_KEY],
+}
+
 def parse_since(s: Optional[str]) -> Optional[str]:
     if not s:
         return None
@@ -47,7 +61,13 @@ def parse_since(s: Optional[str]) -> Optional[str]:
     except Exception:
         raise ValueError("Invalid --since format. Use '2h', '30m', '1d', or ISO timestamp.")
 
-def parse_filters(args) -> Tuple[str, List[Any]]:
+def has_column(db_path: str, table: str, column: str) -> bool:
+    conn = sqlite3.connect(db_path)
+    cols = [r[1] for r in conn.execute(f"PRAGMA table_info({table})")]
+    conn.close()
+    return column in cols
+
+def parse_filters(args, sev_rank: bool = True) -> Tuple[str, List[Any]]:
     where = []
     params: List[Any] = []
     if args.since:
@@ -58,7 +78,12 @@ def parse_filters(args) -> Tuple[str, List[Any]]:
         until = parse_since(args.until)
         where.append("ts <= ?")
         params.append(until)
-    if args.min_severity:
+    if args.min_severity and sev_rank:
+        # sev_rank is precomputed at insert time, so this is an index range scan
+        where.append("sev_rank >= ?")
+        params.append(SEV_ORDER[args.min_severity])
+    elif args.min_severity:
+        # DBs not yet migrated by detector.py have no sev_rank column
         where.append("""
         CASE severity
             WHEN 'Low' THEN 1
@@ -96,14 +121,24 @@ def parse_filters(args) -> Tuple[str, List[Any]]:
     where_clause = (" WHERE " + " AND ".join(w.strip() for w in where)) if where else ""
     return where_clause, params
 
+def sql_unique(args) -> bool:
+    # custom --columns may omit the key columns, so those keep the Python dedupe
+    return bool(args.unique) and not args.columns
+
 def build_select(args) -> str:
-    cols = args.columns.split(",") if args.columns else [
-        "ts","process_name","pid","dest_ip","dest_domain","matched_domain","category","severity","match_type","laddr","lport","raddr","rport"
-    ]
+    cols = args.columns.split(",") if args.columns else list(DEFAULT_COLUMNS)
+    if sql_unique(args):
+        # one row per key: the latest detection, i.e. what ts DESC + apply_unique kept
+        cols = ["MAX(ts) AS ts" if c == "ts" else c for c in cols]
     select_cols = ", ".join(c.strip() for c in cols)
     base = f"SELECT {select_cols} FROM detections"
     return base
 
+def build_group_by(args) -> str:
+    if not sql_unique(args):
+        return ""
+    return " GROUP BY " + ", ".join(UNIQUE_KEYS[args.unique])
+
 def apply_unique(rows: List[Dict[str,Any]], mode: Optional[str]) -> List[Dict[str,Any]]:
     if not mode:
         return rows
@@ -126,10 +161,14 @@ def apply_unique(rows: List[Dict[str,Any]], mode: Optional[str]) -> List[Dict[st
         out.append(r)
     return out
 
-def fetch_rows(db_path: str, sql: str, params: List[Any], order: str, limit: Optional[int]) -> List[Dict[str,Any]]:
+def fetch_rows(db_path: str, sql: str, params: List[Any], order: str, limit: Optional[int]) -> Tuple[List[str], sqlite3.Cursor]:
+    """
+    Execute the query and return (column_names, cursor) without fetching.
+    Rows are plain tuples pulled lazily in batches; the caller closes cur.connection.
+    """
     conn = sqlite3.connect(db_path)
-    conn.row_factory = sqlite3.Row
     cur = conn.cursor()
+    cur.arraysize = 1000
     order_clause = ""
     if order:
         if order not in ("ts", "severity", "process_name", "dest_domain", "matched_domain", "dest_ip"):
@@ -138,9 +177,37 @@ def fetch_rows(db_path: str, sql: str, params: List[Any], order: str, limit: Opt
         order_clause = f" ORDER BY {order} {direction}"
     limit_clause = f" LIMIT {int(limit)}" if limit else ""
     cur.execute(sql + order_clause + limit_clause, params)
-    rows = [dict(r) for r in cur.fetchall()]
-    conn.close()
-    return rows
+    cols = [d[0] for d in cur.description]
+    return cols, cur
+
+def iter_cursor(cur: sqlite3.Cursor) -> Iterator[tuple]:
+    while True:
+        batch = cur.fetchmany()
+        if not batch:
+            return
+        yield from batch
+
+def write_csv(cols: List[str], records: Iterable[tuple], outfile: Optional[str]):
+    it = iter(records)
+    first = next(it, None)
+    if first is None:
+        print("No rows.", file=sys.stderr)
+        return
+    if outfile:
+        with open(outfile, "w", newline="", encoding="utf-8") as f:
+            w = csv.writer(f)
+            w.writerow(cols)
+            w.writerow(first)
+            n = 1
+            for r in it:
+                w.writerow(r)
+                n += 1
+        print(f"Wrote CSV -> {outfile} ({n} rows)")
+    else:
+        w = csv.writer(sys.stdout)
+        w.writerow(cols)
+        w.writerow(first)
+        w.writerows(it)
 
 def main():
     ap = argparse.ArgumentParser(description="SignalDaemon detections exporter")
@@ -163,11 +230,20 @@ def main():
     if not os.path.exists(args.db):
         print(f"DB not found: {args.db}", file=sys.stderr)
         sys.exit(2)
-    where, params = parse_filters(args)
-    sql = build_select(args) + where
-    rows = fetch_rows(args.db, sql, params, args.order, args.limit)
-    if args.unique:
-        rows = apply_unique(rows, args.unique)
+    where, params = parse_filters(args, sev_rank=has_column(args.db, "detections", "sev_rank"))
+    sql = build_select(args) + where + build_group_by(args)
+    cols, cur = fetch_rows(args.db, sql, params, args.order, args.limit)
+    records: Iterable[tuple] = iter_cursor(cur)
+    if args.unique and not sql_unique(args):
+        deduped = apply_unique([dict(zip(cols, r)) for r in records], args.unique)
+        records = [tuple(r.values()) for r in deduped]
+    if args.out == "csv":
+        # streamed from the cursor so large exports never sit in memory at once
+        write_csv(cols, records, args.outfile)
+        cur.connection.close()
+        return
+    rows = [dict(zip(cols, r)) for r in records]
+    cur.connection.close()
     if args.out == "json":
         data = json.dumps(rows, indent=2)
         if args.outfile:
@@ -176,26 +252,10 @@ def main():
             print(f"Wrote JSON -> {args.outfile}")
         else:
             print(data)
-    elif args.out == "csv":
-        if not rows:
-            print("No rows.", file=sys.stderr)
-            sys.exit(0)
-        cols = list(rows[0].keys())
-        if args.outfile:
-            with open(args.outfile, "w", newline="", encoding="utf-8") as f:
-                w = csv.DictWriter(f, fieldnames=cols)
-                w.writeheader()
-                w.writerows(rows)
-            print(f"Wrote CSV -> {args.outfile} ({len(rows)} rows)")
-        else:
-            w = csv.DictWriter(sys.stdout, fieldnames=cols)
-            w.writeheader()
-            w.writerows(rows)
     else:
         if not rows:
             print("No rows.")
             sys.exit(0)
-        cols = list(rows[0].keys())
         widths = [max(len(str(r.get(c,""))) for r in rows + [{c:c}]) for c in cols]
         fmt = " | ".join("{:<" + str(w) + "}" for w in widths)
         print(fmt.format(*cols))